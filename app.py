@@ -1,19 +1,33 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import pickle, json, os
+import pickle, json, os, io, csv, tempfile, html
 from streamlit_lottie import st_lottie
 from report import generate_pdf_report
+from onnx_models import load_onnx, OnnxClassifier, BatchPredictor
 import plotly.express as px
-from chatbot import doctor_chatbot
+from chatbot import doctor_chatbot, has_api_key
+from ui_styles import inject_style
 from datetime import datetime
+from functools import lru_cache
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as futures_wait, TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+# orjson is optional — same fallback as in db.py
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 # DB helpers (MySQL)
-from db import create_user, authenticate_user, insert_report, get_reports_for_user, insert_chat, get_chats_for_user
+from db import create_user, authenticate_user, insert_report, get_reports_for_user, get_patient_names_for_user, flush_chat_buffer, get_chats_for_user
 # Optional DB delete helper — if not implemented in your db module the code falls back to session-state removal
 try:
     from db import delete_report as db_delete_report
@@ -26,18 +40,32 @@ st.set_page_config(page_title="MedGuardian", page_icon="🧬", layout="wide")
 # ---------- Settings ----------
 TIMEOUT_MINUTES = 180  # auto-logout after this many minutes of inactivity
 
+CHAT_HISTORY_LIMIT = 40  # chat messages loaded from the DB / rendered on the chatbot page
+
+# Dashboard display lookups
+COND_ICONS = {"Heart": "❤️", "Diabetes": "🍬", "Kidney": "🧪"}
+COND_COLORS = {"Heart": "#ff4b4b", "Diabetes": "#ffb84d", "Kidney": "#7cd992"}
+RISK_BINS = [(70, "#ff4b4b"), (40, "#ffb84d"), (0, "#7cd992")]  # (min risk %, card colour), highest first
+
 # ---------- Helpers ----------
 def safe_rerun():
     """
     Modern Streamlit-safe rerun:
-    1) try st.experimental_rerun (older versions)
-    2) else update st.query_params (supported stable API) to force reload
+    1) try st.rerun (Streamlit >= 1.27)
+    2) else st.experimental_rerun (older versions)
+    3) else update st.query_params (supported stable API) to force reload
+    Callers make all their session-state / cache changes first and call this
+    once per user action, so each action costs exactly one script rerun. The
+    query-param path forces a full client reload and is only a last resort.
     """
-    try:
-        st.experimental_rerun()
-        return
-    except Exception:
-        pass
+    for rerun in (getattr(st, "rerun", None), getattr(st, "experimental_rerun", None)):
+        if rerun is None:
+            continue
+        try:
+            rerun()
+            return
+        except Exception:
+            pass
 
     try:
         params = dict(st.query_params or {})
@@ -48,94 +76,404 @@ def safe_rerun():
         st.stop()
 
 
-def update_last_active():
-    st.session_state["last_active"] = time.time()
+def update_last_active(min_interval=30):
+    """
+    Record user activity, at most once every min_interval seconds — this is
+    called from every page branch, so skipping no-op writes avoids needless
+    session-state churn. The logout check uses >= against the stored value,
+    so the debounce can only end a session slightly early, never extend it.
+    """
+    now = time.time()
+    prev = st.session_state.get("last_active") or 0
+    if now - prev >= min_interval:
+        st.session_state["last_active"] = now
+
+
+def _flush_pending_chats():
+    """
+    Write buffered chat messages to the DB in one batch; kept for a later retry if that fails.
+    Returns True when nothing is left unsaved.
+    """
+    pending = st.session_state.get("pending_chats")
+    if not pending or not st.session_state.get("user"):
+        return True
+    try:
+        flush_chat_buffer(st.session_state.user['id'], pending)
+        st.session_state.pending_chats = []
+        return True
+    except Exception:
+        return False
+
+
+def _reset_user_session():
+    """Forget everything tied to the signed-in user (logout / timeout)."""
+    if not _flush_pending_chats():
+        # they belong to the user signing out, so they can't wait for a later retry;
+        # the notice is shown on the login page after the rerun
+        st.session_state.logout_notice = (
+            f"{len(st.session_state.pending_chats)} chat message(s) could not be saved to your account and were discarded."
+        )
+    st.session_state.pop("pending_chats", None)
+    st.session_state.user = None
+    st.session_state.chat_history = []
+    st.session_state.pop("chat_loaded", None)
+    st.session_state.pop("local_reports", None)
+    st.session_state.pop("report_keys", None)
+    _clear_report_cache()
 
 
 def check_auto_logout():
     """Log out user if inactivity exceeded TIMEOUT_MINUTES."""
     if st.session_state.get("user") and st.session_state.get("last_active"):
         elapsed = time.time() - st.session_state["last_active"]
-        if elapsed > TIMEOUT_MINUTES * 60:
-            st.session_state.user = None
-            st.session_state.chat_history = []
+        if elapsed >= TIMEOUT_MINUTES * 60:
+            _reset_user_session()
             st.warning(f"Session timed out after {TIMEOUT_MINUTES} minutes of inactivity. Please login again.")
             safe_rerun()
 
 
+@lru_cache(maxsize=1)
+def _fmt_minute(minute: int):
+    return datetime.fromtimestamp(minute * 60).strftime("%d-%m-%Y %I:%M %p")
+
+
+def _report_timestamp():
+    """Current time as shown on reports; the format only has minute precision, so it is formatted once a minute."""
+    return _fmt_minute(int(time.time()) // 60)
+
+
+def _new_patient_id():
+    """Report number for the next prediction (MG-YYYYMMDD-HHMMSS)."""
+    return f"MG-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+
+def _report_key(r):
+    """Identity of a report for de-duplication: (Patient ID, Condition, Date)."""
+    return (r.get("Patient ID"), r.get("Condition"), r.get("Date"))
+
+
+MAX_LOCAL_REPORTS = 50  # cap on unsaved reports held in session state
+
+
+def _keep_local_report(report):
+    """Keep a report that could not be saved to the DB, so it still shows on the Dashboard."""
+    local = st.session_state.local_reports
+    keys = st.session_state.report_keys
+    key = _report_key(report)
+    if key not in keys:
+        local.append(report)
+        if report.get("Patient ID"):
+            keys.add(key)
+        for dropped in local[:-MAX_LOCAL_REPORTS]:
+            keys.discard(_report_key(dropped))
+        del local[:-MAX_LOCAL_REPORTS]
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_reports(user_id: int, patient_name=None, condition=None):
+    """Per-user report list from MySQL, cached for a minute. Call _clear_report_cache() after any write."""
+    return get_reports_for_user(user_id, patient_name=patient_name, condition=condition)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_patient_names(user_id: int):
+    return get_patient_names_for_user(user_id)
+
+
+def _clear_report_cache():
+    _fetch_reports.clear()
+    _fetch_patient_names.clear()
+
+
+# one entry per exported row plus one per filtered list, shared by every user —
+# bounded so the process-wide cache can't grow without limit
+@st.cache_data(show_spinner=False, max_entries=1000, ttl="1h")
+def _reports_csv(rows):
+    """
+    CSV bytes for a tuple of reports, each given as a tuple of (key, value) items.
+    Uses csv.DictWriter (no DataFrame) and is cached, so unchanged rows are not
+    re-encoded on every rerun.
+    """
+    dicts = [dict(items) for items in rows]
+    fieldnames = list(dict.fromkeys(k for d in dicts for k in d))
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(dicts)
+    return buf.getvalue().encode("utf-8")
+
+
+def _row_csv(r):
+    return _reports_csv((tuple(r.items()),))
+
+
+def _pdf_bytes(condition, report, diagnosis):
+    """
+    Render a report PDF and return its bytes. Uses a private temp file so
+    concurrent sessions/threads don't overwrite each other's output.
+    Safe to run on a worker thread (no Streamlit calls).
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        generate_pdf_report(condition, report, diagnosis, filename=path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# process-wide, so bounded like _make_report_pdf
+@st.cache_data(show_spinner=False, max_entries=200, ttl=3600)
+def _make_pdf_cached(condition, report_frozen):
+    """PDF bytes for a Dashboard report. report_frozen is tuple(sorted(r.items())) so it can be hashed."""
+    return _pdf_bytes(condition, dict(report_frozen), f"{condition} Report")
+
+
+@st.cache_resource
+def _background_executor():
+    """Process-wide pool for report persistence work (survives reruns)."""
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def _report_digest(condition, report, diagnosis):
+    """Content hash of a report + its PDF title/diagnosis, stable across key order."""
+    payload = (condition, report, diagnosis)
+    if orjson is not None:
+        data = orjson.dumps(payload, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        data = json.dumps(payload, default=str, sort_keys=True).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=200, ttl="1h")
+def _make_report_pdf(digest, condition, _report, diagnosis):
+    # _report is left out of Streamlit's cache key; digest already covers its content
+    return _pdf_bytes(condition, _report, diagnosis)
+
+
+def _save_and_offer_pdf(report, pdf_condition, diagnosis, file_name):
+    """
+    After a prediction: save the report to the DB on the background pool while
+    the PDF is rendered here (or served from cache when an identical report was
+    already rendered, e.g. a double click). The prediction result has already
+    been shown; all Streamlit calls stay on the main thread.
+    """
+    user = st.session_state.get("user")
+    insert_fut = _background_executor().submit(insert_report, user['id'], report) if user else None
+
+    digest = _report_digest(pdf_condition, report, diagnosis)
+    pdf_bytes, pdf_error = None, None
+    with st.spinner("Saving report and preparing PDF..."):
+        try:
+            pdf_bytes = _make_report_pdf(digest, pdf_condition, report, diagnosis)
+        except Exception as e:
+            pdf_error = e
+        if insert_fut is not None:
+            futures_wait([insert_fut])
+
+    saved = False
+    if insert_fut is None:
+        st.info("Login to save this report to your account.")
+    elif insert_fut.exception() is not None:
+        st.error("Failed to save report: " + str(insert_fut.exception()))
+    elif insert_fut.result() is False:
+        # same (patient, report no., condition, date) as a saved row — a resubmit
+        saved = True
+        st.info("This report is already saved to your account.")
+    else:
+        _clear_report_cache()
+        saved = True
+        update_last_active()
+        st.success("Report saved to your account.")
+    if not saved:
+        _keep_local_report(report)
+    # the next prediction is a new report and gets its own report number
+    st.session_state.auto_patient_id = _new_patient_id()
+
+    if pdf_error is not None:
+        st.error("PDF generation error: " + str(pdf_error))
+    else:
+        st.download_button("📄 Download Hospital Report", pdf_bytes, file_name=file_name, mime="application/pdf", key=f"dl_{digest}")
+
+
+@st.cache_data(show_spinner=False, ttl=300)
+def _risk_bar_fig(records):
+    """Risk comparison bar chart from a tuple of (patient name, condition, risk) triples."""
+    df = pd.DataFrame(list(records), columns=['Patient Name', 'Condition', 'Risk %'])
+    df['Risk %'] = pd.to_numeric(df['Risk %'], errors='coerce').fillna(0)
+    fig = px.bar(df, x='Patient Name', y='Risk %', color='Condition', text='Risk %', template='plotly_white',
+                 color_discrete_map=COND_COLORS)
+    fig.update_traces(textposition="outside", marker_line_width=0.8, marker_line_color='rgba(0,0,0,0.12)')
+    fig.update_layout(yaxis_title="Risk %", xaxis_title="Patient", margin=dict(t=40,b=30), bargap=0.25)
+    return fig
+
+
+def _row_html(r, bar_color):
+    """Detail card shown inside a Dashboard expander, as one complete (closed) HTML fragment."""
+    return f"""
+        <div style="background:rgba(255,255,255,0.60); padding:15px;border-radius:12px; backdrop-filter:blur(8px); box-shadow: 0 6px 22px rgba(0,0,0,0.08); border-left:6px solid {bar_color};">
+        <b>👤 Patient Id:</b> {r.get("Patient ID","-")}<br>
+        <b>👤 Patient:</b> {r.get("Patient Name","-")}<br>
+        <b>🎂 Age:</b> {r.get("Age","-")} &nbsp;&nbsp;&nbsp; <b>| ⚧ Gender:</b> {r.get("Gender","-")} <br>
+        <b>🔎 Contact:</b> {r.get("Phone", r.get("Patient Contact","-"))} &nbsp;&nbsp;&nbsp; <b>| Referred By:</b> {r.get("Referred By","-")}<br><br>
+        <b>🩺 Condition:</b> {r.get("Condition","-")}<br>
+        <b>📊 Risk Level:</b> {r.get("Risk %", 0)}%<br>
+        </div>
+    """
+
+
+@st.cache_resource
+def _asset_map():
+    """Which optional image assets exist next to app.py — stat'ed once per process, not on every rerun."""
+    return {name: os.path.exists(os.path.join(BASE_DIR, name)) for name in ("logo.png", "logo_splash.png", "welcome.json")}
+
+
 # -------------------- Load Lottie --------------------
+@st.cache_data(show_spinner=False)
 def load_lottie(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Parsed Lottie JSON, read once per process. Returns None if the file is missing or invalid."""
+    try:
+        return _json_loads(Path(path).read_bytes())
+    except (FileNotFoundError, ValueError):
+        return None
+
+welcome_anim = load_lottie(os.path.join(BASE_DIR, "welcome.json")) if _asset_map()["welcome.json"] else None
 
-welcome_anim = None
-if os.path.exists("welcome.json"):
+# -------------------- Load Models (FIXED) --------------------
+def _load_pickle(name, path):
+    """
+    Load one pickled model. Runs on a worker thread, so it must not touch
+    the Streamlit API — errors are returned as text for the caller to show.
+    If a converted .onnx file sits next to the pickle it is served through
+    onnxruntime instead (same predict/predict_proba interface).
+    Returns (name, model_or_None, error_or_None).
+    """
     try:
-        welcome_anim = load_lottie("welcome.json")
+        onnx_model = load_onnx(path)
+        if onnx_model is not None:
+            return name, onnx_model, None
     except Exception:
-        welcome_anim = None
+        pass  # broken/incompatible .onnx — fall back to the pickle
+
+    try:
+        # read the whole (small) file at once, then unpickle from memory
+        with open(path, "rb") as f:
+            return name, pickle.loads(f.read()), None
+    except FileNotFoundError:
+        return name, None, f"❌ {name} model file not found: {path}"
+    except Exception as e:
+        return name, None, f"❌ Failed to load {name} model: {e}"
+
+
+# The heart and kidney models are RandomForests (see the notebooks), which, like
+# the ONNX graphs, work in float32 — building their inputs in that dtype up front
+# avoids a hidden conversion copy inside predict().
+MODEL_INPUT_DTYPE = np.float32
+# The diabetes model is a soft VotingClassifier that includes a LogisticRegression,
+# which computes in float64: float32 input would only lose precision there, so it
+# keeps float64 (its tree members do the cheap float32 cast themselves).
+DIABETES_INPUT_DTYPE = np.float64
+
+# Kidney selectbox options that encode as 1 (all other options, incl. "Don't Know", are 0)
+_YES = frozenset({"Yes", "Poor", "Abnormal"})
+
+
+def conv(x):
+    """Encode a kidney selectbox value; options are fixed strings so no normalisation is needed."""
+    return 1 if x in _YES else 0
+
+
+# Column order the kidney model was trained on
+KIDNEY_FEATURES = (
+    "age", "blood_pressure", "specific_gravity", "albumin", "sugar",
+    "red_blood_cells", "pus_cell", "pus_cell_clumps", "bacteria",
+    "blood_glucose_random", "blood_urea", "serum_creatinine", "sodium", "potassium",
+    "haemoglobin", "packed_cell_volume", "white_blood_cell_count",
+    "red_blood_cell_count", "hypertension",
+    "diabetes_mellitus", "coronary_artery_disease",
+    "appetite", "peda_edema",
+    "aanemia",
+)
+
+KIDNEY_COLUMNS = pd.Index(KIDNEY_FEATURES)  # built once for the sklearn fallback's DataFrame
+
+# (name, path parts under BASE_DIR) — also fixes the return order of load_models()
+MODEL_SPECS = [
+    ("Diabetes", ("Diabetes", "diabetes_model.pkl")),
+    ("Heart",    ("Heart",    "heart_model.pkl")),
+    ("Kidney",   ("Kidney",   "kidney_model.pkl")),
+]
+
 
-# -------------------- Load Models (FIXED) --------------------
 @st.cache_resource
 def load_models():
     """
     Load diabetes, heart and kidney models using absolute paths.
     This fixes case-sensitivity and relative-path issues on Linux servers.
+    The files are independent, so they are read and unpickled concurrently;
+    any errors are reported in a single st.error back on the main thread.
+    The returned models are shared by every session and rerun in this
+    process (st.cache_resource) — never mutate them; copy first if needed.
     """
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    loaded, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=len(MODEL_SPECS)) as executor:
+        futures = [executor.submit(_load_pickle, name, os.path.join(BASE_DIR, *parts))
+                   for name, parts in MODEL_SPECS]
+        for fut in as_completed(futures):
+            name, model, err = fut.result()
+            loaded[name] = model
+            if err:
+                errors[name] = err
 
-    diabetes_path = os.path.join(BASE_DIR, "Diabetes", "diabetes_model.pkl")
-    heart_path    = os.path.join(BASE_DIR, "Heart",    "heart_model.pkl")
-    kidney_path   = os.path.join(BASE_DIR, "Kidney",   "kidney_model.pkl")
+    if errors:
+        st.error("\n\n".join(errors[name] for name, _ in MODEL_SPECS if name in errors))
 
-    diabetes = heart = kidney = None
+    return tuple(loaded.get(name) for name, _ in MODEL_SPECS)
 
-    # Diabetes model
-    if os.path.exists(diabetes_path):
-        try:
-            with open(diabetes_path, "rb") as f:
-                diabetes = pickle.load(f)
-        except Exception as e:
-            st.error(f"❌ Failed to load Diabetes model: {e}")
-    else:
-        st.error(f"❌ Diabetes model file not found: {diabetes_path}")
 
-    # Heart model
-    if os.path.exists(heart_path):
-        try:
-            with open(heart_path, "rb") as f:
-                heart = pickle.load(f)
-        except Exception as e:
-            st.error(f"❌ Failed to load Heart model: {e}")
-    else:
-        st.error(f"❌ Heart model file not found: {heart_path}")
+diabetes_model, heart_model, kidney_model = load_models()
 
-    # Kidney model
-    if os.path.exists(kidney_path):
-        try:
-            with open(kidney_path, "rb") as f:
-                kidney = pickle.load(f)
-        except Exception as e:
-            st.error(f"❌ Failed to load Kidney model: {e}")
-    else:
-        st.error(f"❌ Kidney model file not found: {kidney_path}")
 
-    return diabetes, heart, kidney
+def _predict_label_proba(model, X):
+    """
+    (label, P(class 1)) for the first row from one inference call.
+    sklearn's predict() is argmax over predict_proba(), so for these binary
+    models label 1 <=> P(1) > 0.5 — no second pass through the estimator.
+    """
+    if isinstance(model, OnnxClassifier):
+        labels, proba = model.predict_with_proba(X)
+        return labels[0], proba[0][1]
+    p1 = model.predict_proba(X)[0][1]
+    return int(p1 > 0.5), p1
 
 
-diabetes_model, heart_model, kidney_model = load_models()
+@st.cache_resource
+def _kidney_batcher():
+    """One process-wide BatchPredictor over the ONNX kidney model (only used when it loaded via ONNX)."""
+    return BatchPredictor(kidney_model.predict_with_proba, max_batch=32, max_wait=0.01)
 
 # -------------------- Session init --------------------
 if "user" not in st.session_state:
     st.session_state.user = None
-if "reports" not in st.session_state:
-    st.session_state.reports = []
+if "local_reports" not in st.session_state:
+    # only reports that could not be saved to the DB; saved ones are read back via _fetch_reports
+    st.session_state.local_reports = []
+if "report_keys" not in st.session_state:
+    # _report_key() of every local report, kept in step with local_reports (O(1) duplicate check)
+    st.session_state.report_keys = set()
 if "auto_patient_id" not in st.session_state:
-    st.session_state.auto_patient_id = f"MG-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    st.session_state.auto_patient_id = _new_patient_id()
 if "last_active" not in st.session_state:
     st.session_state.last_active = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "pending_chats" not in st.session_state:
+    # (role, message) pairs not yet written to the DB — see _flush_pending_chats()
+    st.session_state.pending_chats = []
 if "welcome_done" not in st.session_state:
     st.session_state.welcome_done = False
 if "start_time" not in st.session_state:
@@ -153,14 +491,79 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+inject_style()  # shared GLASS_CSS (chat bubbles, glass cards)
+
 # -------------------- AUTH (Full-page card) --------------------
+# Anti-thrash for the login form, not a security control: successful logins
+# are memoized for a few seconds and repeated failures are slowed down.
+MAX_LOGIN_BACKOFF = 30  # seconds
+
+
+def _credential_key(username, password):
+    """Opaque cache key for a login attempt — the raw credentials are never used as a key or logged."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(username.encode())
+    h.update(b"\0")
+    h.update(password.encode())
+    return h.hexdigest()
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _cached_authenticate(cred_key, _username, _password):
+    # underscore args are excluded from Streamlit's cache key; cred_key stands in for them
+    return authenticate_user(_username, _password)
+
+
+def _login_failures():
+    """
+    This browser session's {username: (consecutive failures, monotonic time of last failure)}.
+    Kept per session rather than process-wide, so failed attempts from another
+    client can never lock a user out of their own correct login.
+    """
+    return st.session_state.setdefault("login_failures", {})
+
+
+def _prune_login_failures(failed, now):
+    """Drop entries whose backoff has run out so tried usernames don't pile up."""
+    for name in [n for n, (_, last) in failed.items() if now - last > MAX_LOGIN_BACKOFF]:
+        del failed[name]
+
+
+def _login_wait_seconds(username):
+    """Seconds this session must still wait before another attempt for username (0 if none)."""
+    failed = _login_failures()
+    now = time.monotonic()
+    _prune_login_failures(failed, now)
+    entry = failed.get(username)
+    if not entry:
+        return 0
+    count, last = entry
+    return max(0, min(2 ** count, MAX_LOGIN_BACKOFF) - (now - last))
+
+
+def _login_attempt(username, password):
+    """authenticate_user() behind the short-lived success cache and the failure backoff."""
+    u = _cached_authenticate(_credential_key(username, password), username, password)
+    failed = _login_failures()
+    if u:
+        failed.pop(username, None)
+    else:
+        count, _ = failed.get(username, (0, 0))
+        failed[username] = (count + 1, time.monotonic())
+    return u
+
+
 def show_auth_page():
+    notice = st.session_state.pop("logout_notice", None)
+    if notice:
+        st.warning(notice)
+
     logo_splash_path = os.path.join(BASE_DIR, "logo_splash.png")
     logo_path = os.path.join(BASE_DIR, "logo.png")
 
-    if os.path.exists(logo_splash_path):
+    if _asset_map()["logo_splash.png"]:
         logo_img = logo_splash_path
-    elif os.path.exists(logo_path):
+    elif _asset_map()["logo.png"]:
         logo_img = logo_path
     else:
         logo_img = None
@@ -199,6 +602,7 @@ def show_auth_page():
                 else:
                     ok = create_user(reg_user.strip(), reg_pw, reg_full.strip(), reg_phone.strip())
                     if ok:
+                        _cached_authenticate.clear()  # drop any cached "no such user" result
                         st.success("Account created — please login.")
                     else:
                         st.error("Username already exists or error occurred.")
@@ -211,8 +615,11 @@ def show_auth_page():
                 if not login_user or not login_pw:
                     st.error("Enter username and password.")
                 else:
-                    u = authenticate_user(login_user.strip(), login_pw)
-                    if u:
+                    wait = _login_wait_seconds(login_user.strip())
+                    u = None if wait else _login_attempt(login_user.strip(), login_pw)
+                    if wait:
+                        st.error(f"Too many failed attempts. Try again in {int(wait) + 1} s.")
+                    elif u:
                         st.session_state.user = u
                         update_last_active()
                         st.success(f"Welcome, {u.get('full_name') or u.get('username')}")
@@ -241,9 +648,9 @@ with st.sidebar:
     sidebar_logo_path = os.path.join(BASE_DIR, "logo.png")
     sidebar_splash_path = os.path.join(BASE_DIR, "logo_splash.png")
 
-    if os.path.exists(sidebar_logo_path):
+    if _asset_map()["logo.png"]:
         st.image(sidebar_logo_path, width=170)
-    elif os.path.exists(sidebar_splash_path):
+    elif _asset_map()["logo_splash.png"]:
         st.image(sidebar_splash_path, width=170)
 
 
@@ -257,14 +664,17 @@ with st.sidebar:
     st.markdown("### 🔐 Account")
     st.markdown(f"**Signed in as:** {st.session_state.user['username']}")
     if st.button("Logout"):
-        st.session_state.user = None
-        st.session_state.chat_history = []
+        _reset_user_session()
         st.success("Logged out.")
         safe_rerun()
     st.markdown("---")
     page = st.radio("Navigation", ["🏠 Dashboard","🩺 Health Scan","🤖 Doctor Chatbot"], index=0)
     st.info("Early Disease Prediction AI")
 
+# leaving the chatbot page retries whatever an earlier failed write left buffered
+if page != "🤖 Doctor Chatbot":
+    _flush_pending_chats()
+
 # -------------------- DASHBOARD (DB-backed when logged in) --------------------
 if page == "🏠 Dashboard":
     update_last_active()
@@ -272,87 +682,97 @@ if page == "🏠 Dashboard":
     st.markdown("<p style='text-align:center;opacity:0.7;'>Patient Health Report Center</p>", unsafe_allow_html=True)
     st.markdown("<hr style='border:1px solid #cfe2ff;'>", unsafe_allow_html=True)
 
-    reports_db = get_reports_for_user(st.session_state.user['id'])
-    reports = []
-    for r in reports_db:
-        raw = r.get("raw") or {}
-        if raw:
-            raw['__db_id'] = r.get('id')
-            reports.append(raw)
-        else:
-            entry = {
-                "Patient ID": r.get("patient_id"),
-                "Patient Name": r.get("patient_name"),
-                "Phone": r.get("phone"),
-                "Doctor Name": r.get("doctor_name"),
-                "Referred By": r.get("referred_by"),
-                "Sample Collected": r.get("sample_collected"),
-                "Report Generated By": r.get("report_generated_by"),
-                "Date": r.get("date"),
-                "Condition": r.get("condition_name"),
-                "Risk %": r.get("risk")
-            }
-            entry['__db_id'] = r.get('id')
-            reports.append(entry)
-
-    # merge with session reports (local unsaved) — keep uniqueness
-    for r in st.session_state.reports:
-        if not any((r.get('Patient ID') == rr.get('Patient ID') and r.get('Date') == rr.get('Date') and r.get('Condition') == rr.get('Condition')) for rr in reports):
-            r['__db_id'] = None
-            reports.append(r)
-
-    st.session_state.reports = reports  # keep unified view
+    user_id = st.session_state.user['id']
+    local_patients = {r.get("Patient Name","Unknown") for r in st.session_state.local_reports}
+    patients = sorted(set(_fetch_patient_names(user_id)) | local_patients)
 
-    if not reports:
+    if not patients:
         st.info("📌 No reports found yet. Please run a prediction first.")
     else:
-        patients = sorted({r.get("Patient Name","Unknown") for r in reports})
-        patient_filter = st.selectbox("👤 Filter by Patient", ["All"] + patients)
-        disease_filter = st.selectbox("🩺 Filter by Condition", ["All","Heart","Diabetes","Kidney"])
-        filtered = reports
-        if patient_filter != "All":
-            filtered = [r for r in filtered if r.get("Patient Name","Unknown") == patient_filter]
-        if disease_filter != "All":
-            filtered = [r for r in filtered if r.get("Condition") == disease_filter]
+        # both filters are applied together on submit, so changing them costs one rerun
+        patient_options = ["All"] + patients
+        disease_options = ["All","Heart","Diabetes","Kidney"]
+        saved_filters = st.session_state.get("filters", {})
+        prev_patient = saved_filters.get("patient", "All")
+        prev_disease = saved_filters.get("disease", "All")
+        with st.form("filters"):
+            patient_filter = st.selectbox("👤 Filter by Patient", patient_options,
+                                          index=patient_options.index(prev_patient) if prev_patient in patient_options else 0)
+            disease_filter = st.selectbox("🩺 Filter by Condition", disease_options,
+                                          index=disease_options.index(prev_disease) if prev_disease in disease_options else 0)
+            st.form_submit_button("Apply")
+        st.session_state["filters"] = {"patient": patient_filter, "disease": disease_filter}
+
+        # filtering of saved reports happens in SQL; "All" means no condition
+        reports_db = _fetch_reports(
+            user_id,
+            patient_name=None if patient_filter == "All" else patient_filter,
+            condition=None if disease_filter == "All" else disease_filter,
+        )
+        # DB rows already match the filters; local reports are checked once while merging
+        filtered = []
+        for r in reports_db:
+            raw = r.get("raw") or {}
+            if raw:
+                raw['__db_id'] = r.get('id')
+                filtered.append(raw)
+            else:
+                entry = {
+                    "Patient ID": r.get("patient_id"),
+                    "Patient Name": r.get("patient_name"),
+                    "Phone": r.get("phone"),
+                    "Doctor Name": r.get("doctor_name"),
+                    "Referred By": r.get("referred_by"),
+                    "Sample Collected": r.get("sample_collected"),
+                    "Report Generated By": r.get("report_generated_by"),
+                    "Date": r.get("date"),
+                    "Condition": r.get("condition_name"),
+                    "Risk %": r.get("risk")
+                }
+                entry['__db_id'] = r.get('id')
+                filtered.append(entry)
+
+        def matches_filters(r):
+            return ((patient_filter == "All" or r.get("Patient Name","Unknown") == patient_filter)
+                    and (disease_filter == "All" or r.get("Condition") == disease_filter))
+
+        # merge with session reports (local unsaved). Saved reports are unique by
+        # the DB's uq_report key and local ones by report_keys, so no cross-check is needed.
+        for r in st.session_state.local_reports:
+            r['__db_id'] = None
+            if matches_filters(r):
+                filtered.append(r)
+
         if not filtered:
             st.warning("⚠ No records found for selected filters.")
         else:
             for i, r in enumerate(filtered):
                 pid  = r.get("Patient ID","-")
                 name = r.get("Patient Name","-")
-                age = r.get("Age","-")
-                gender = r.get("Gender","-")
-                contact = r.get("Phone", r.get("Patient Contact","-"))
-                referred_by = r.get("Referred By","-")
                 condition = r.get("Condition","-")
                 risk = r.get("Risk %", 0)
-                bar_color = "#ff4b4b" if risk>=70 else "#ffb84d" if risk>=40 else "#7cd992"
-                icon = "❤️" if condition=="Heart" else "🍬" if condition=="Diabetes" else "🧪"
+                bar_color = next((c for t, c in RISK_BINS if risk >= t), RISK_BINS[-1][1])
+                icon = COND_ICONS.get(condition, "🧪")
                 dbid = r.get('__db_id')
+                # deterministic per (report, widget) — never time-based, so widget state survives reruns
+                row_key = f"{dbid if dbid is not None else 'local'}_{i}"
 
                 with st.expander(f"{icon} {condition} — {name} | Risk: {risk}%", expanded=False):
-                    st.markdown(f"""
-                        <div style="background:rgba(255,255,255,0.60); padding:15px;border-radius:12px; backdrop-filter:blur(8px); box-shadow: 0 6px 22px rgba(0,0,0,0.08); border-left:6px solid {bar_color};">
-                        <b>👤 Patient Id:</b> {pid}<br>
-                        <b>👤 Patient:</b> {name}<br>
-                        <b>🎂 Age:</b> {age} &nbsp;&nbsp;&nbsp; <b>| ⚧ Gender:</b> {gender} <br>
-                        <b>🔎 Contact:</b> {contact} &nbsp;&nbsp;&nbsp; <b>| Referred By:</b> {referred_by}<br><br>
-                        <b>🩺 Condition:</b> {condition}<br>
-                        <b>📊 Risk Level:</b> {risk}%<br>
-                    """, unsafe_allow_html=True)
+                    st.markdown(_row_html(r, bar_color), unsafe_allow_html=True)
 
                     cols = st.columns([1,1,1])
                     with cols[0]:
-                        try:
-                            p = generate_pdf_report(condition, r, f"{condition} Report")
-                            with open(p,"rb") as f:
-                                st.download_button(f"📄 Download {condition} Report", f, file_name=f"{name}_{condition}_Report.pdf", key=f"pdf_{i}_{int(time.time())}")
-                        except Exception as e:
-                            st.error("PDF generation error: "+str(e))
+                        # PDF is only built when asked for (and memoized), not on every rerun
+                        if st.button("📄 Prepare PDF", key=f"prep_pdf_{row_key}"):
+                            try:
+                                pdf_bytes = _make_pdf_cached(condition, tuple(sorted(r.items())))
+                                st.download_button(f"📄 Download {condition} Report", pdf_bytes, file_name=f"{name}_{condition}_Report.pdf", mime="application/pdf", key=f"pdf_{row_key}")
+                            except Exception as e:
+                                st.error("PDF generation error: "+str(e))
                     with cols[1]:
-                        st.download_button("💾 Export (CSV)", pd.DataFrame([r]).to_csv(index=False).encode('utf-8'), file_name=f"{name}_{condition}_report.csv", key=f"csv_{i}_{int(time.time())}")
+                        st.download_button("💾 Export (CSV)", _row_csv(r), file_name=f"{name}_{condition}_report.csv", key=f"csv_{row_key}")
                     with cols[2]:
-                        stable_key = f"del_btn_{dbid if dbid is not None else 'local'}_{i}"
+                        stable_key = f"del_btn_{row_key}"
                         if st.button("🗑️ Delete Record", key=stable_key):
                             st.session_state['delete_candidate'] = {
                                 'db_id': dbid,
@@ -366,7 +786,7 @@ if page == "🏠 Dashboard":
                     if cand and cand.get('pid') == pid and cand.get('condition') == condition and cand.get('date') == r.get('Date'):
                         st.warning("You are about to delete this record. This action cannot be undone.")
                         c1, c2 = st.columns([1,1])
-                        if c1.button("Confirm Delete", key=f"confirm_del_{dbid if dbid is not None else 'local'}_{i}"):
+                        if c1.button("Confirm Delete", key=f"confirm_del_{row_key}"):
                             removed_db = False
                             if cand.get('db_id') and db_delete_report is not None:
                                 try:
@@ -374,6 +794,7 @@ if page == "🏠 Dashboard":
                                     if ok:
                                         st.success("✔️ Database record deleted successfully.")
                                         removed_db = True
+                                        _clear_report_cache()
                                     else:
                                         st.warning("⚠️ Database reported 0 rows affected (no deletion).")
                                 except Exception as e:
@@ -381,43 +802,37 @@ if page == "🏠 Dashboard":
                             else:
                                 st.info("No DB delete helper available or record is unsaved (local-only).")
 
-                            try:
-                                before = len(st.session_state.get('reports', []))
-                                st.session_state.reports = [
-                                    rr for rr in st.session_state.get('reports', [])
-                                    if not (rr.get('Patient ID') == cand.get('pid') and rr.get('Condition') == cand.get('condition') and rr.get('Date') == cand.get('date'))
-                                ]
-                                after = len(st.session_state.get('reports', []))
-                                if after < before:
-                                    st.success("✔️ Report removed from local session view.")
-                                else:
-                                    st.warning("⚠️ Report not found in local session list to remove.")
-                            except Exception as e:
-                                st.error(f"Failed to remove local record: {e}")
+                            if not removed_db:
+                                try:
+                                    before = len(st.session_state.get('local_reports', []))
+                                    st.session_state.local_reports = [
+                                        rr for rr in st.session_state.get('local_reports', [])
+                                        if not (rr.get('Patient ID') == cand.get('pid') and rr.get('Condition') == cand.get('condition') and rr.get('Date') == cand.get('date'))
+                                    ]
+                                    after = len(st.session_state.get('local_reports', []))
+                                    st.session_state.get('report_keys', set()).discard((cand.get('pid'), cand.get('condition'), cand.get('date')))
+                                    if after < before:
+                                        st.success("✔️ Report removed from local session view.")
+                                    else:
+                                        st.warning("⚠️ Report not found in local session list to remove.")
+                                except Exception as e:
+                                    st.error(f"Failed to remove local record: {e}")
 
                             st.session_state.pop('delete_candidate', None)
                             update_last_active()
                             safe_rerun()
 
-                        if c2.button("Cancel", key=f"cancel_del_{dbid if dbid is not None else 'local'}_{i}"):
+                        if c2.button("Cancel", key=f"cancel_del_{row_key}"):
                             st.session_state.pop('delete_candidate', None)
                             safe_rerun()
 
-                    st.markdown("</div>", unsafe_allow_html=True)
 
             st.write("---")
             st.subheader("📈 Patient Risk Comparison")
-            df = pd.DataFrame(filtered)
-            if 'Patient Name' not in df.columns:
-                df['Patient Name'] = df.get('Patient Name', pd.Series(["Unknown"]*len(df)))
-            df['Risk %'] = pd.to_numeric(df['Risk %'], errors='coerce').fillna(0)
-            fig = px.bar(df, x='Patient Name', y='Risk %', color='Condition', text='Risk %', template='plotly_white',
-                         color_discrete_map={"Heart":"#ff4b4b","Diabetes":"#ffb84d","Kidney":"#7cd992"})
-            fig.update_traces(textposition="outside", marker_line_width=0.8, marker_line_color='rgba(0,0,0,0.12)')
-            fig.update_layout(yaxis_title="Risk %", xaxis_title="Patient", margin=dict(t=40,b=30), bargap=0.25)
+            fig = _risk_bar_fig(tuple((r.get("Patient Name", "Unknown"), r.get("Condition"), r.get("Risk %")) for r in filtered))
             st.plotly_chart(fig, use_container_width=True)
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button("💾 Download All Filtered Reports (CSV)", csv, "All_Reports.csv", key=f"csv_{int(time.time())}")
+            all_csv = _reports_csv(tuple(tuple(r.items()) for r in filtered))
+            st.download_button("💾 Download All Filtered Reports (CSV)", all_csv, "All_Reports.csv", key="csv_all_filtered")
 
 # -------------------- HEALTH SCAN --------------------
 elif page=="🩺 Health Scan":
@@ -510,20 +925,21 @@ elif page=="🩺 Health Scan":
         if st.button("🔍 Predict Heart Risk"):
             if not validate_patient_details():
                 st.stop()
-            data = np.array([[age,sex_val,cp,trestbps,chol,fbs_val,restecg,thalach,exang_val,oldpeak,slope,ca,thal]])
-            res = heart_model.predict(data)[0] if heart_model is not None else 0
-            prob = heart_model.predict_proba(data)[0][1]*100 if heart_model is not None else 0
+            data = np.asarray([[age,sex_val,cp,trestbps,chol,fbs_val,restecg,thalach,exang_val,oldpeak,slope,ca,thal]], dtype=MODEL_INPUT_DTYPE)
+            res, prob = _predict_label_proba(heart_model, data) if heart_model is not None else (0, 0)
+            prob *= 100
             result = "⚠️ High Risk" if res==1 else "✅ Safe"
             st.success(f"{result} | Probability: {prob:.1f}%")
+            now_str = _report_timestamp()
             report = {
                 "Patient ID": st.session_state.get("patient_id","-"),
                 "Patient Name": st.session_state.get("patient_name","-"),
                 "Phone": st.session_state.get("patient_contact","-"),
                 "Doctor Name": st.session_state.get("doctor_name","-"),
                 "Referred By": st.session_state.get("referred_by","-"),
-                "Sample Collected": st.session_state.get("sample_collected", datetime.now().strftime("%d-%m-%Y %I:%M %p")),
+                "Sample Collected": st.session_state.get("sample_collected", now_str),
                 "Report Generated By": st.session_state.get("report_generated_by","MedGuardian AI Lab System"),
-                "Date": datetime.now().strftime("%d-%m-%Y %I:%M %p"),
+                "Date": now_str,
                 "Age": age,
                 "Gender": "Male" if sex_val==1 else "Female",
                 "Condition":"Heart",
@@ -540,22 +956,7 @@ elif page=="🩺 Health Scan":
                 "Major Vessels Colored": ca,
                 "Thalassemia": thal
             }
-            key_tuple = (report["Patient ID"], report["Condition"], report["Date"])
-            existing_keys = {(r.get("Patient ID"), r.get("Condition"), r.get("Date")) for r in st.session_state.reports if r.get("Patient ID")}
-            if key_tuple not in existing_keys:
-                st.session_state.reports.append(report)
-            if st.session_state.get("user"):
-                try:
-                    insert_report(st.session_state.user['id'], report)
-                    update_last_active()
-                    st.success("Report saved to your account.")
-                except Exception as e:
-                    st.error("Failed to save report: " + str(e))
-            else:
-                st.info("Login to save this report to your account.")
-            path = generate_pdf_report("Heart Disease", report, result)
-            with open(path,"rb") as f:
-                st.download_button("📄 Download Hospital Report",f,"Heart_Report.pdf")
+            _save_and_offer_pdf(report, "Heart Disease", result, "Heart_Report.pdf")
 
     # ---------- DIABETES ----------
     if disease=="Diabetes":
@@ -572,20 +973,21 @@ elif page=="🩺 Health Scan":
         if st.button("🔍 Predict Diabetes"):
             if not validate_patient_details():
                 st.stop()
-            data = np.array([[gender_val,age,bmi,glu,hba,hyt_val]])
-            res = diabetes_model.predict(data)[0] if diabetes_model is not None else 0
-            prob = diabetes_model.predict_proba(data)[0][1]*100 if diabetes_model is not None else 0
+            data = np.asarray([[gender_val,age,bmi,glu,hba,hyt_val]], dtype=DIABETES_INPUT_DTYPE)
+            res, prob = _predict_label_proba(diabetes_model, data) if diabetes_model is not None else (0, 0)
+            prob *= 100
             result = "⚠️ Diabetes Risk" if res==1 else "✅ Normal"
             st.success(f"{result} | {prob:.1f}%")
+            now_str = _report_timestamp()
             report = {
                 "Patient ID": st.session_state.get("patient_id","-"),
                 "Patient Name": st.session_state.get("patient_name","-"),
                 "Phone": st.session_state.get("patient_contact","-"),
                 "Doctor Name": st.session_state.get("doctor_name","-"),
                 "Referred By": st.session_state.get("referred_by","-"),
-                "Sample Collected": st.session_state.get("sample_collected", datetime.now().strftime("%d-%m-%Y %I:%M %p")),
+                "Sample Collected": st.session_state.get("sample_collected", now_str),
                 "Report Generated By": st.session_state.get("report_generated_by","MedGuardian AI Lab System"),
-                "Date": datetime.now().strftime("%d-%m-%Y %I:%M %p"),
+                "Date": now_str,
                 "Age": age,
                 "Gender": "Male" if gender_val==1 else "Female",
                 "Condition":"Diabetes",
@@ -595,84 +997,93 @@ elif page=="🩺 Health Scan":
                 "HbA1c": hba,
                 "Hypertension": hyt_val
             }
-            key_tuple = (report["Patient ID"], report["Condition"], report["Date"])
-            existing_keys = {(r.get("Patient ID"), r.get("Condition"), r.get("Date")) for r in st.session_state.reports if r.get("Patient ID")}
-            if key_tuple not in existing_keys:
-                st.session_state.reports.append(report)
-            if st.session_state.get("user"):
-                try:
-                    insert_report(st.session_state.user['id'], report)
-                    update_last_active()
-                    st.success("Report saved to your account.")
-                except Exception as e:
-                    st.error("Failed to save report: " + str(e))
-            else:
-                st.info("Login to save this report to your account.")
-            path = generate_pdf_report("Diabetes", report, result)
-            with open(path,"rb") as f:
-                st.download_button("📄 Download Hospital Report",f,"Diabetes_Report.pdf")
+            _save_and_offer_pdf(report, "Diabetes", result, "Diabetes_Report.pdf")
 
     # ---------- KIDNEY ----------
     if disease=="Kidney":
         st.subheader("🧪 Kidney Disease Input Panel")
         st.info("⚠️ If you don't know any value, leave it as default (Normal)")
-        gender_choice = st.radio("Gender",["Male","Female"])
-        gender_val = 1 if gender_choice=="Male" else 0
-        col1, col2 = st.columns(2)
-        with col1:
-            age = st.number_input("Age",1,100,40)
-            bp = st.number_input("Blood Pressure (mmHg)",60,200,120)
-            sg = st.selectbox("Specific Gravity", [1.005,1.010,1.015,1.020,1.025])
-            albumin = st.select_slider("Albumin (0-5)", [0,1,2,3,4,5])
-            sugar = st.select_slider("Sugar (0-5)", [0,1,2,3,4,5])
-            rbc = st.selectbox("Red Blood Cells",["Normal","Abnormal","Don't Know"])
-            pus = st.selectbox("Pus Cell",["Normal","Abnormal","Don't Know"])
-            pc = st.selectbox("Pus Cell Clumps",["No","Yes","Don't Know"])
-            bac = st.selectbox("Bacteria",["No","Yes","Don't Know"])
-            appetite = st.selectbox("Appetite",["Good","Poor","Don't Know"])
-            edema = st.selectbox("Pedal Edema",["No","Yes","Don't Know"])
-            anemia = st.selectbox("Anemia",["No","Yes","Don't Know"])
-        with col2:
-            bgr = st.number_input("Blood Glucose Random",0,500,120)
-            bu = st.number_input("Blood Urea",0,250,40)
-            sc = st.number_input("Serum Creatinine",0.0,15.0,1.1)
-            sodium = st.number_input("Sodium",100,170,140)
-            potassium = st.number_input("Potassium",2.0,10.0,4.5)
-            hb = st.number_input("Haemoglobin",5.0,20.0,13.0)
-            pcv = st.number_input("Packed Cell Volume",10,60,40)
-            wbc = st.number_input("White Blood Cell Count",2000,20000,8000)
-            rbc_count = st.number_input("Red Blood Cell Count",2.0,8.0,4.9)
-            hypertension = st.selectbox("Hypertension",["No","Yes","Don't Know"])
-            diabetes = st.selectbox("Diabetes Mellitus",["No","Yes","Don't Know"])
-            cad = st.selectbox("Coronary Artery Disease",["No","Yes","Don't Know"])
-        conv = lambda x: 1 if str(x).strip().lower() in ["yes","poor","abnormal","1","true"] else 0
-        df = pd.DataFrame([{ 
-            "age":age,"blood_pressure":bp,"specific_gravity":sg,"albumin":albumin,"sugar":sugar,
-            "red_blood_cells":conv(rbc),"pus_cell":conv(pus),"pus_cell_clumps":conv(pc),"bacteria":conv(bac),
-            "blood_glucose_random":bgr,"blood_urea":bu,"serum_creatinine":sc,"sodium":sodium,"potassium":potassium,
-            "haemoglobin":hb,"packed_cell_volume":pcv,"white_blood_cell_count":wbc,
-            "red_blood_cell_count":rbc_count,"hypertension":conv(hypertension),
-            "diabetes_mellitus":conv(diabetes),"coronary_artery_disease":conv(cad),
-            "appetite":conv(appetite),"peda_edema":conv(edema),
-            "aanemia": conv(anemia)
-        }])
-        st.caption("Each field has a help tooltip — hover or tap to read meaning and expected ranges.")
-        if st.button("🔍 Predict Kidney Disease"):
+        # all inputs are submitted together — editing a field doesn't rerun the script
+        with st.form("kidney_form"):
+            gender_choice = st.radio("Gender",["Male","Female"])
+            gender_val = 1 if gender_choice=="Male" else 0
+            col1, col2 = st.columns(2)
+            with col1:
+                age = st.number_input("Age",1,100,40)
+                bp = st.number_input("Blood Pressure (mmHg)",60,200,120)
+                sg = st.selectbox("Specific Gravity", [1.005,1.010,1.015,1.020,1.025])
+                albumin = st.select_slider("Albumin (0-5)", [0,1,2,3,4,5])
+                sugar = st.select_slider("Sugar (0-5)", [0,1,2,3,4,5])
+                rbc = st.selectbox("Red Blood Cells",["Normal","Abnormal","Don't Know"])
+                pus = st.selectbox("Pus Cell",["Normal","Abnormal","Don't Know"])
+                pc = st.selectbox("Pus Cell Clumps",["No","Yes","Don't Know"])
+                bac = st.selectbox("Bacteria",["No","Yes","Don't Know"])
+                appetite = st.selectbox("Appetite",["Good","Poor","Don't Know"])
+                edema = st.selectbox("Pedal Edema",["No","Yes","Don't Know"])
+                anemia = st.selectbox("Anemia",["No","Yes","Don't Know"])
+            with col2:
+                bgr = st.number_input("Blood Glucose Random",0,500,120)
+                bu = st.number_input("Blood Urea",0,250,40)
+                sc = st.number_input("Serum Creatinine",0.0,15.0,1.1)
+                sodium = st.number_input("Sodium",100,170,140)
+                potassium = st.number_input("Potassium",2.0,10.0,4.5)
+                hb = st.number_input("Haemoglobin",5.0,20.0,13.0)
+                pcv = st.number_input("Packed Cell Volume",10,60,40)
+                wbc = st.number_input("White Blood Cell Count",2000,20000,8000)
+                rbc_count = st.number_input("Red Blood Cell Count",2.0,8.0,4.9)
+                hypertension = st.selectbox("Hypertension",["No","Yes","Don't Know"])
+                diabetes = st.selectbox("Diabetes Mellitus",["No","Yes","Don't Know"])
+                cad = st.selectbox("Coronary Artery Disease",["No","Yes","Don't Know"])
+            st.caption("Each field has a help tooltip — hover or tap to read meaning and expected ranges.")
+            submitted = st.form_submit_button("🔍 Predict Kidney Disease")
+        # handled outside the form: st.download_button is not allowed inside one
+        if submitted:
             if not validate_patient_details():
                 st.stop()
-            res = kidney_model.predict(df)[0] if kidney_model is not None else 0
-            prob = kidney_model.predict_proba(df)[0][1]*100 if kidney_model is not None else 0
+            # encode the yes/no style answers once; reused for the model row and the report
+            enc = {name: conv(val) for name, val in (
+                ("rbc", rbc), ("pus", pus), ("pc", pc), ("bac", bac), ("hypertension", hypertension),
+                ("diabetes", diabetes), ("cad", cad), ("appetite", appetite), ("edema", edema), ("anemia", anemia))}
+            # one row in KIDNEY_FEATURES order, written straight into a typed buffer
+            # (per click, not module-level: sessions run concurrently and the batcher reads it later)
+            x = np.empty((1, len(KIDNEY_FEATURES)), dtype=MODEL_INPUT_DTYPE)
+            x[0] = (
+                age, bp, sg, albumin, sugar,
+                enc["rbc"], enc["pus"], enc["pc"], enc["bac"],
+                bgr, bu, sc, sodium, potassium,
+                hb, pcv, wbc,
+                rbc_count, enc["hypertension"],
+                enc["diabetes"], enc["cad"],
+                enc["appetite"], enc["edema"],
+                enc["anemia"]
+            )
+            if kidney_model is None:
+                res, prob = 0, 0
+            elif isinstance(kidney_model, OnnxClassifier):
+                # label and probabilities come out of a single session.run,
+                # batched with any other sessions predicting at the same moment
+                try:
+                    label, proba = _kidney_batcher().submit(x).result(timeout=1.0)
+                except FutureTimeoutError:
+                    labels, probas = kidney_model.predict_with_proba(x)
+                    label, proba = labels[0], probas[0]
+                res, prob = label, proba[1]*100
+            else:
+                # the pickled pipeline was fitted on named columns
+                res, prob = _predict_label_proba(kidney_model, pd.DataFrame(x, columns=KIDNEY_COLUMNS))
+                prob *= 100
             result = "⚠️ CKD Risk Detected" if res==1 else "✅ Kidneys Healthy"
             st.success(f"{result} | Risk: {prob:.2f}%")
+            now_str = _report_timestamp()
             report = {
                 "Patient ID": st.session_state.get("patient_id","-"),
                 "Patient Name": st.session_state.get("patient_name","-"),
                 "Phone": st.session_state.get("patient_contact","-"),
                 "Doctor Name": st.session_state.get("doctor_name","-"),
                 "Referred By": st.session_state.get("referred_by","-"),
-                "Sample Collected": st.session_state.get("sample_collected", datetime.now().strftime("%d-%m-%Y %I:%M %p")),
+                "Sample Collected": st.session_state.get("sample_collected", now_str),
                 "Report Generated By": st.session_state.get("report_generated_by","MedGuardian AI Lab System"),
-                "Date": datetime.now().strftime("%d-%m-%Y %I:%M %p"),
+                "Date": now_str,
                 "Age": age,
                 "Gender": "Male" if gender_val==1 else "Female",
                 "Condition":"Kidney",
@@ -681,10 +1092,10 @@ elif page=="🩺 Health Scan":
                 "Specific Gravity": sg,
                 "Albumin": albumin,
                 "Sugar": sugar,
-                "red_blood_cells": conv(rbc),
-                "Pus Cell": conv(pus),
-                "Pus Cell Clumps": conv(pc),
-                "Bacteria": conv(bac),
+                "red_blood_cells": enc["rbc"],
+                "Pus Cell": enc["pus"],
+                "Pus Cell Clumps": enc["pc"],
+                "Bacteria": enc["bac"],
                 "Blood Glucose Random": bgr,
                 "Blood Urea": bu,
                 "Serum Creatinine": sc,
@@ -694,29 +1105,14 @@ elif page=="🩺 Health Scan":
                 "Packed Blood Volume": pcv,
                 "White Blood Cell Count": wbc,
                 "Red Blood Cell Count": rbc_count,
-                "Hypertension": conv(hypertension),
-                "Diabetes Mellitus": conv(diabetes),
-                "Coronary Artery Disease": conv(cad),
-                "Appetite": conv(appetite),
-                "Peda Edema": conv(edema),
-                "aanemia": conv(anemia)
+                "Hypertension": enc["hypertension"],
+                "Diabetes Mellitus": enc["diabetes"],
+                "Coronary Artery Disease": enc["cad"],
+                "Appetite": enc["appetite"],
+                "Peda Edema": enc["edema"],
+                "aanemia": enc["anemia"]
             }
-            key_tuple = (report["Patient ID"], report["Condition"], report["Date"])
-            existing_keys = {(r.get("Patient ID"), r.get("Condition"), r.get("Date")) for r in st.session_state.reports if r.get("Patient ID")}
-            if key_tuple not in existing_keys:
-                st.session_state.reports.append(report)
-            if st.session_state.get("user"):
-                try:
-                    insert_report(st.session_state.user['id'], report)
-                    update_last_active()
-                    st.success("Report saved to your account.")
-                except Exception as e:
-                    st.error("Failed to save report: " + str(e))
-            else:
-                st.info("Login to save this report to your account.")
-            path = generate_pdf_report("Kidney Disease", report, result)
-            with open(path,"rb") as f:
-                st.download_button("📄 Download Hospital Report",f,"Kidney_Report.pdf")
+            _save_and_offer_pdf(report, "Kidney Disease", result, "Kidney_Report.pdf")
 
 # -------------------- DOCTOR CHATBOT (improved + debug) --------------------
 elif page == "🤖 Doctor Chatbot":
@@ -730,41 +1126,29 @@ elif page == "🤖 Doctor Chatbot":
     )
     st.caption("Tip: Turn off Gemini to use only fast local rule-based replies.")
 
-    api_present = True
-    try:
-        key = st.secrets.get("GEMINI_API_KEY") if hasattr(st, "secrets") else None
-        if not key:
-            key = os.environ.get("GEMINI_API_KEY")
-        if use_gemini and not key:
-            st.warning("Gemini API key not found. Add GEMINI_API_KEY to .streamlit/secrets.toml")
-            api_present = False
-    except Exception:
-        api_present = False
+    api_present = has_api_key()
+    if use_gemini and not api_present:
+        st.warning("Gemini API key not found. Add GEMINI_API_KEY to .streamlit/secrets.toml")
 
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-        if st.session_state.get("user"):
-            try:
-                rows = get_chats_for_user(st.session_state.user['id'], limit=500)
-                for r in rows:
-                    label = "You" if r['role'] == 'user' else "Doctor"
-                    st.session_state.chat_history.append((label, r['message']))
-            except Exception:
-                pass
+    # session init always creates chat_history, so a flag marks that the DB history was loaded
+    if st.session_state.get("user") and not st.session_state.get("chat_loaded"):
+        st.session_state.chat_loaded = True
+        try:
+            rows = get_chats_for_user(st.session_state.user['id'], limit=CHAT_HISTORY_LIMIT)
+            loaded = [("You" if r['role'] == 'user' else "Doctor", r['message']) for r in rows]
+            st.session_state.chat_history = loaded + st.session_state.chat_history
+        except Exception:
+            pass
 
     chat_container = st.container()
     with chat_container:
-        for sender, message in st.session_state.chat_history:
+        # only the tail is rendered — older messages are still kept in the session
+        for sender, message in st.session_state.chat_history[-CHAT_HISTORY_LIMIT:]:
+            # styling lives in ui_styles.GLASS_CSS (.chat-user / .chat-bot)
             if sender == "You":
-                st.markdown(
-                    f"<div style='background:#D5F5E3;padding:12px;border-radius:12px;margin:8px;text-align:right;'>"
-                    f"<b>👤 You:</b> {message}</div>",
-                    unsafe_allow_html=True)
+                st.markdown(f"<div class='chat-user'><b>👤 You:</b> {html.escape(message)}</div>", unsafe_allow_html=True)
             else:
-                st.markdown(
-                    f"<div style='background:#E8DAEF;padding:12px;border-radius:12px;margin:8px;text-align:left;'>"
-                    f"<b>🤖 Doctor AI:</b> {message}</div>",
-                    unsafe_allow_html=True)
+                st.markdown(f"<div class='chat-bot'><b>🤖 Doctor AI:</b> {html.escape(message)}</div>", unsafe_allow_html=True)
 
     st.write("---")
 
@@ -783,11 +1167,6 @@ elif page == "🤖 Doctor Chatbot":
             update_last_active()
 
             st.session_state.chat_history.append(("You", user_input))
-            if st.session_state.get("user"):
-                try:
-                    insert_chat(st.session_state.user['id'], "user", user_input)
-                except Exception:
-                    pass
 
             th = st.empty()
             th.markdown(
@@ -816,10 +1195,10 @@ elif page == "🤖 Doctor Chatbot":
 
             st.session_state.chat_history.append(("Doctor", reply))
             if st.session_state.get("user"):
-                try:
-                    insert_chat(st.session_state.user['id'], "bot", reply)
-                except Exception:
-                    pass
+                # each completed turn is written as one two-row batch; a failed write stays
+                # buffered and is retried with the next turn / on leaving the page
+                st.session_state.pending_chats.extend([("user", user_input), ("bot", reply)])
+                _flush_pending_chats()
 
             safe_rerun()
 
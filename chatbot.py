@@ -1,5 +1,6 @@
 # chatbot.py
 import os, json, logging, requests
+from functools import lru_cache
 from typing import Optional, List, Dict
 
 logger = logging.getLogger("medguardian.chatbot")
@@ -16,7 +17,12 @@ DEFAULT_MAX_TOKENS = 512
 DEFAULT_TEMPERATURE = 0.2
 DEFAULT_TOP_P = 0.95
 
+# one keep-alive HTTP session per process, so each send skips the TCP/TLS handshake
+_http = requests.Session()
+
+@lru_cache(maxsize=1)
 def _get_api_key():
+    """Resolved once per process (a missing key raises and is not cached, so it is retried)."""
     try:
         import streamlit as st
         if hasattr(st, "secrets") and st.secrets.get("GEMINI_API_KEY"):
@@ -28,6 +34,13 @@ def _get_api_key():
         return k
     raise RuntimeError("GEMINI_API_KEY not found in environment or Streamlit secrets.")
 
+def has_api_key() -> bool:
+    try:
+        _get_api_key()
+        return True
+    except Exception:
+        return False
+
 def _build_system_prompt(style="concise"):
     base = ("You are MedGuardian, a careful medical assistant. Provide accurate, concise medical information, suggest tests and lifestyle changes, "
             "and recommend when to see a professional. Do not give prescriptions or definitive diagnoses. For emergencies advise immediate care.")
@@ -46,7 +59,7 @@ def _call_gemini_rest(prompt: str, max_tokens:int=DEFAULT_MAX_TOKENS, temperatur
         }
     }
     headers = {"Content-Type":"application/json", "x-goog-api-key": api_key}
-    resp = requests.post(REST_ENDPOINT, headers=headers, json=payload, timeout=30)
+    resp = _http.post(REST_ENDPOINT, headers=headers, json=payload, timeout=30)
     if resp.status_code != 200:
         logger.error("Gemini REST failed: %s %s", resp.status_code, resp.text)
         raise RuntimeError(f"Gemini REST error {resp.status_code}: {resp.text}")
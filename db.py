@@ -1,9 +1,30 @@
 # db.py
-import mysql.connector
+import MySQLdb
+from MySQLdb.cursors import DictCursor
 import bcrypt
 import json
+import queue
+import threading
+import time
+from collections import OrderedDict
 from typing import List, Dict, Any
 
+# orjson is an optional, faster drop-in for encoding/decoding stored report JSON
+try:
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        # numpy scalars (model probabilities) stay numbers; decoded to str so a
+        # MySQL JSON column doesn't reject it as binary
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, default=str)
+
 # ---------- Update these if you change credentials ----------
 DB_CONFIG = {
     "host": "localhost",      # localhost (use this when Streamlit runs on same EC2)
@@ -11,18 +32,101 @@ DB_CONFIG = {
     "password": "mg_pass",    # your MySQL user's password (updated)
     "database": "medguardian",# your DB name
     "port": 3306,
-    "raise_on_warnings": True,
+    "charset": "utf8mb4",
     "autocommit": False
 }
 
 
 def get_conn():
     """Return a new MySQL connection using DB_CONFIG"""
-    return mysql.connector.connect(**DB_CONFIG)
+    return MySQLdb.connect(**DB_CONFIG)
+
+
+# Read-only queries borrow an autocommit connection from a small process-wide
+# pool instead of connecting for every call. Streamlit runs each rerun on a new
+# thread, so a thread-local connection would not outlive the rerun.
+# Writes keep using a fresh get_conn() each.
+READ_POOL_SIZE = 4
+_read_pool = queue.LifoQueue(maxsize=READ_POOL_SIZE)  # (conn, {dictionary: cursor})
+
+
+def _borrow_read_conn():
+    try:
+        return _read_pool.get_nowait()
+    except queue.Empty:
+        return MySQLdb.connect(**{**DB_CONFIG, "autocommit": True}), {}
+
+
+def _return_read_conn(entry):
+    try:
+        _read_pool.put_nowait(entry)
+    except queue.Full:
+        _close_quietly(entry[0])
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _drain_read_pool():
+    """Close every idle pooled connection (after one dropped, the rest are likely stale too)."""
+    while True:
+        try:
+            conn, _ = _read_pool.get_nowait()
+        except queue.Empty:
+            return
+        _close_quietly(conn)
+
+
+def _read_cursor(conn, cursors, dictionary: bool):
+    """
+    Cursor kept with its pooled connection (one dict cursor, one tuple
+    cursor). mysqlclient escapes parameters and decodes rows in C, so there
+    is nothing left for a server-side prepared statement to save.
+    """
+    cur = cursors.get(dictionary)
+    if cur is None:
+        cur = conn.cursor(DictCursor) if dictionary else conn.cursor()
+        cursors[dictionary] = cur
+    return cur
+
+
+def _read_rows(sql: str, params: tuple, dictionary: bool = True):
+    """
+    Run a SELECT on a pooled read connection and return all rows.
+    autocommit means every query sees fresh data (no stale REPEATABLE READ snapshot).
+    A dropped connection is discarded with the rest of the pool and the SELECT retried once.
+    """
+    for attempt in (0, 1):
+        conn, cursors = _borrow_read_conn()
+        try:
+            cur = _read_cursor(conn, cursors, dictionary)
+            cur.execute(sql, params)
+            rows = list(cur.fetchall())  # mysqlclient returns a tuple
+        except (MySQLdb.InterfaceError, MySQLdb.OperationalError):
+            _close_quietly(conn)
+            _drain_read_pool()
+            if attempt:
+                raise
+            continue
+        except Exception:
+            _close_quietly(conn)
+            raise
+        _return_read_conn((conn, cursors))
+        return rows
+
+# bcrypt cost for new hashes. 10 is ~4x cheaper than the library default of 12;
+# checkpw reads the cost from each stored hash, so older cost-12 hashes still verify.
+BCRYPT_ROUNDS = 10
+
 
 # ----- User functions -----
 def create_user(username: str, password: str, full_name: str = None, phone: str = None) -> bool:
-    pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    # hashed before connecting so the connection isn't held open while bcrypt runs
+    pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
     conn = get_conn()
     cur = conn.cursor()
     try:
@@ -31,8 +135,9 @@ def create_user(username: str, password: str, full_name: str = None, phone: str
             (username, pw_hash, full_name, phone)
         )
         conn.commit()
+        _forget_user(username)
         return True
-    except mysql.connector.errors.IntegrityError:
+    except MySQLdb.IntegrityError:
         conn.rollback()
         return False
     finally:
@@ -40,27 +145,106 @@ def create_user(username: str, password: str, full_name: str = None, phone: str
         conn.close()
 
 
-def authenticate_user(username: str, password: str):
+def _bcrypt_cost(pw_hash: bytes) -> int:
+    """Cost factor of a bcrypt hash ($2b$<cost>$...)."""
+    return int(pw_hash.split(b"$")[2])
+
+
+# Unknown usernames are checked against a dummy hash so they still pay for a
+# bcrypt check. It is built at the highest cost still stored (older accounts
+# may predate BCRYPT_ROUNDS until their next login rehashes them), so an
+# unknown name costs as much as the slowest real account. Accounts already at
+# a lower cost remain measurably faster until the table converges; the cost is
+# re-read on the next process start.
+_dummy_hash = None
+_dummy_lock = threading.Lock()
+
+
+def _get_dummy_hash() -> bytes:
+    global _dummy_hash
+    with _dummy_lock:
+        if _dummy_hash is None:
+            rows = _read_rows(
+                "SELECT MAX(CAST(SUBSTRING(password_hash, 5, 2) AS UNSIGNED)) FROM users",
+                (), dictionary=False
+            )
+            cost = max(BCRYPT_ROUNDS, int((rows[0][0] if rows else None) or 0))
+            _dummy_hash = bcrypt.hashpw(b"medguardian-dummy", bcrypt.gensalt(rounds=cost))
+        return _dummy_hash
+
+
+# username -> (users row or None, monotonic time fetched), most recently used
+# last. Unknown usernames are cached too, so a recent lookup is equally fast
+# whether or not the account exists; entries expire after USER_CACHE_TTL so an
+# account created by another process isn't hidden for long.
+USER_CACHE_SIZE = 2048
+USER_CACHE_TTL = 60  # seconds
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+
+def _user_row(username: str):
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(username)
+        if entry is not None and now - entry[1] < USER_CACHE_TTL:
+            _user_cache.move_to_end(username)
+            return entry[0]
+    rows = _read_rows("SELECT id, username, password_hash, full_name FROM users WHERE username = %s", (username,))
+    row = rows[0] if rows else None
+    with _user_cache_lock:
+        _user_cache[username] = (row, now)
+        _user_cache.move_to_end(username)
+        if len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return row
+
+
+def _forget_user(username: str):
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+
+
+def _rehash_password(user_id: int, username: str, password: str):
+    """Re-store a verified password at BCRYPT_ROUNDS (older hashes keep their original cost)."""
+    pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
     conn = get_conn()
-    cur = conn.cursor(dictionary=True)
+    cur = conn.cursor()
     try:
-        cur.execute("SELECT id, username, password_hash, full_name FROM users WHERE username = %s", (username,))
-        row = cur.fetchone()
+        cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (pw_hash, user_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         cur.close()
         conn.close()
+    _forget_user(username)
 
-    if not row:
-        return None
+
+def authenticate_user(username: str, password: str):
+    row = _user_row(username)
     try:
-        if bcrypt.checkpw(password.encode(), row["password_hash"].encode()):
-            return {"id": row["id"], "username": row["username"], "full_name": row.get("full_name")}
+        stored = row["password_hash"].encode() if row else _get_dummy_hash()
+        ok = bcrypt.checkpw(password.encode(), stored)
     except Exception:
         return None
-    return None
+    if not (row and ok):
+        return None
+    if _bcrypt_cost(stored) != BCRYPT_ROUNDS:
+        try:
+            _rehash_password(row["id"], row["username"], password)
+        except Exception:
+            pass  # login still succeeds; the rehash is retried next time
+    return {"id": row["id"], "username": row["username"], "full_name": row.get("full_name")}
 
 # ----- Report functions -----
-def insert_report(user_id:int, report:Dict[str,Any]):
+def insert_report(user_id:int, report:Dict[str,Any]) -> bool:
+    """
+    Save a report. A report with the same (user, report no., patient name,
+    condition, date) as an existing row is ignored by the uq_report key;
+    returns False in that case.
+    """
     conn = get_conn()
     cur = conn.cursor()
     try:
@@ -70,6 +254,7 @@ def insert_report(user_id:int, report:Dict[str,Any]):
                 doctor_name, referred_by, sample_collected,
                 report_generated_by, date, condition_name, risk, raw_json
             ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            ON DUPLICATE KEY UPDATE id = id
         """, (
             user_id,
             report.get("Patient ID"),
@@ -82,9 +267,11 @@ def insert_report(user_id:int, report:Dict[str,Any]):
             report.get("Date"),
             report.get("Condition"),
             float(report.get("Risk %", 0) or 0),
-            json.dumps(report, default=str)
+            _json_dumps(report)
         ))
+        inserted = cur.rowcount == 1
         conn.commit()
+        return inserted
     except Exception:
         conn.rollback()
         raise
@@ -93,27 +280,50 @@ def insert_report(user_id:int, report:Dict[str,Any]):
         conn.close()
 
 
-def get_reports_for_user(user_id:int, limit=1000) -> List[Dict[str,Any]]:
-    conn = get_conn()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("SELECT * FROM reports WHERE user_id = %s ORDER BY created_at DESC LIMIT %s", (user_id, limit))
-        rows = cur.fetchall()
-    finally:
-        cur.close()
-        conn.close()
+# Columns the Dashboard actually reads (avoids SELECT * pulling anything else)
+REPORT_COLUMNS = (
+    "id, patient_id, patient_name, phone, doctor_name, referred_by, sample_collected, "
+    "report_generated_by, date, condition_name, risk, raw_json, created_at"
+)
+
+
+def get_reports_for_user(user_id:int, limit=1000, patient_name: str = None, condition: str = None) -> List[Dict[str,Any]]:
+    """
+    Reports for a user, newest first. patient_name / condition narrow the
+    result in SQL (served by idx_reports_user_condition_patient); pass None for "All".
+    """
+    q = f"SELECT {REPORT_COLUMNS} FROM reports WHERE user_id = %s"
+    params = [user_id]
+    if condition:
+        q += " AND condition_name = %s"
+        params.append(condition)
+    if patient_name:
+        q += " AND patient_name = %s"
+        params.append(patient_name)
+    q += " ORDER BY created_at DESC LIMIT %s"
+    params.append(limit)
+    rows = _read_rows(q, tuple(params))
 
     for r in rows:
         try:
-            r['raw'] = json.loads(r.get('raw_json') or '{}')
+            r['raw'] = _json_loads(r.get('raw_json') or b'{}')
         except Exception:
             r['raw'] = {}
     return rows
 
 
+def get_patient_names_for_user(user_id:int) -> List[str]:
+    """Distinct patient names the user has reports for (feeds the Dashboard filter)."""
+    rows = _read_rows(
+        "SELECT DISTINCT patient_name FROM reports WHERE user_id = %s AND patient_name IS NOT NULL",
+        (user_id,), dictionary=False
+    )
+    return [r[0] for r in rows]
+
+
 def get_filtered_reports(user_id:int, condition: str = None, patient_name: str = None):
     conn = get_conn()
-    cur = conn.cursor(dictionary=True)
+    cur = conn.cursor(DictCursor)
     try:
         q = "SELECT * FROM reports WHERE user_id = %s"
         params = [user_id]
@@ -180,13 +390,31 @@ def insert_chat(user_id:int, role:str, message:str):
         conn.close()
 
 
-def get_chats_for_user(user_id:int, limit=500):
+def flush_chat_buffer(user_id:int, messages):
+    """Insert buffered (role, message) pairs for a user in one executemany round trip."""
+    if not messages:
+        return
     conn = get_conn()
-    cur = conn.cursor(dictionary=True)
+    cur = conn.cursor()
     try:
-        cur.execute("SELECT * FROM chats WHERE user_id = %s ORDER BY created_at ASC LIMIT %s", (user_id, limit))
-        rows = cur.fetchall()
+        cur.executemany(
+            "INSERT INTO chats (user_id, role, message) VALUES (%s,%s,%s)",
+            [(user_id, role, message) for role, message in messages]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         cur.close()
         conn.close()
+
+
+def get_chats_for_user(user_id:int, limit=40):
+    """
+    The user's most recent `limit` chat messages, oldest first. id breaks ties
+    between rows of one flush_chat_buffer batch, which share a created_at.
+    """
+    rows = _read_rows("SELECT * FROM chats WHERE user_id = %s ORDER BY created_at DESC, id DESC LIMIT %s", (user_id, limit))
+    rows.reverse()
     return rows
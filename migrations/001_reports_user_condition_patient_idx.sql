@@ -0,0 +1,3 @@
+-- Serves the Dashboard's filtered report query:
+--   WHERE user_id = ? [AND condition_name = ?] [AND patient_name = ?] ORDER BY created_at DESC
+CREATE INDEX idx_reports_user_condition_patient ON reports (user_id, condition_name, patient_name);
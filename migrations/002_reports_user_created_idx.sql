@@ -0,0 +1,4 @@
+-- Serves the per-user "newest first" report queries:
+--   WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+-- (descending index keys need MySQL 8.0+)
+CREATE INDEX idx_reports_user_created ON reports (user_id, created_at DESC);
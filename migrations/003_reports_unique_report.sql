@@ -0,0 +1,15 @@
+-- One row per (user, report no., patient, condition, report date): insert_report
+-- uses INSERT ... ON DUPLICATE KEY UPDATE against this key, so a resubmitted
+-- report is dropped by MySQL instead of being checked for in the app.
+-- patient_id is the per-prediction report number (MG-YYYYMMDD-HHMMSS).
+--
+-- The ALTER fails if duplicates already exist. Back up the table, review them
+-- with the query below and resolve them by hand before applying:
+--
+--   SELECT user_id, patient_id, patient_name, condition_name, date,
+--          COUNT(*) AS n, GROUP_CONCAT(id ORDER BY id) AS ids
+--   FROM reports
+--   GROUP BY user_id, patient_id, patient_name, condition_name, date
+--   HAVING n > 1;
+
+ALTER TABLE reports ADD UNIQUE KEY uq_report (user_id, patient_id, patient_name, condition_name, date);
@@ -0,0 +1,143 @@
+# onnx_models.py
+import os
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# onnxruntime is optional — when it is missing the app keeps using the pickles
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (pickle path parts, number of input features) for the models served through ONNX
+ONNX_MODELS = {
+    "Diabetes": (("Diabetes", "diabetes_model.pkl"), 6),
+    "Heart":    (("Heart",    "heart_model.pkl"),    13),
+    "Kidney":   (("Kidney",   "kidney_model.pkl"),   24),
+}
+
+
+def onnx_path_for(pkl_path):
+    """The .onnx file lives next to its pickle: Heart/heart_model.pkl -> Heart/heart_model.onnx"""
+    return os.path.splitext(pkl_path)[0] + ".onnx"
+
+
+class OnnxClassifier:
+    """
+    Small adapter around an onnxruntime session exposing sklearn's
+    predict() / predict_proba(), so callers don't need to change.
+    """
+
+    def __init__(self, path):
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _run(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        label, proba = self.session.run(None, {self.input_name: X})
+        # the graph computes in float32; sklearn's predict_proba returns float64
+        return label, proba.astype(np.float64)
+
+    def predict_with_proba(self, X):
+        """(labels, probabilities) from one inference call."""
+        return self._run(X)
+
+    def predict(self, X):
+        return self._run(X)[0]
+
+    def predict_proba(self, X):
+        return self._run(X)[1]
+
+
+class BatchPredictor:
+    """
+    Coalesces concurrent single-row predictions into one model call.
+
+    A daemon thread takes the first queued row, waits up to max_wait seconds
+    for up to max_batch - 1 more, stacks them and runs predict_fn once on the
+    batch. Each caller gets its own (label, probabilities) row back through a
+    Future. With a single user this degrades to one call per row plus at most
+    max_wait of latency.
+    """
+
+    def __init__(self, predict_fn, max_batch=32, max_wait=0.01):
+        self.predict_fn = predict_fn  # X (n, k) -> (labels (n,), proba (n, c))
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="batch-predictor", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queue one (1, k) row; the Future resolves to (label, probabilities)."""
+        fut = Future()
+        self._queue.put((row, fut))
+        return fut
+
+    def _loop(self):
+        while True:
+            items = [self._queue.get()]
+            # max_wait bounds the whole batch window, not each get()
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                labels, proba = self.predict_fn(np.concatenate([row for row, _ in items]))
+            except Exception as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+                continue
+            for i, (_, fut) in enumerate(items):
+                fut.set_result((labels[i], proba[i]))
+
+
+def load_onnx(pkl_path):
+    """Return an OnnxClassifier for the model if onnxruntime and the .onnx file are available, else None."""
+    path = onnx_path_for(pkl_path)
+    if ort is None or not os.path.exists(path):
+        return None
+    return OnnxClassifier(path)
+
+
+def convert(pkl_path, n_features):
+    """
+    Offline step: convert a pickled sklearn classifier to ONNX next to the pickle.
+    Needs skl2onnx (not required at runtime).
+    zipmap is disabled so probabilities come back as a plain (n, 2) array.
+    """
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+
+    with open(pkl_path, "rb") as f:
+        model = pickle.loads(f.read())
+    onx = convert_sklearn(
+        model,
+        initial_types=[("input", FloatTensorType([None, n_features]))],
+        options={id(model): {"zipmap": False}},
+    )
+    out = onnx_path_for(pkl_path)
+    with open(out, "wb") as f:
+        f.write(onx.SerializeToString())
+    return out
+
+
+# Run directly to (re)build the .onnx files: python onnx_models.py
+if __name__ == "__main__":
+    for name, (parts, n_features) in ONNX_MODELS.items():
+        out = convert(os.path.join(BASE_DIR, *parts), n_features)
+        print(f"{name}: wrote {out}")
@@ -43,8 +43,11 @@ GLASS_CSS = """
 .stButton>button { border-radius:10px; }
 """
 
+_STYLE_TAG = f"<style>{GLASS_CSS}</style>"  # built once at import
+
 def inject_style():
-    st.markdown(f"<style>{GLASS_CSS}</style>", unsafe_allow_html=True)
+    # must still be emitted on every rerun — Streamlit drops elements a rerun doesn't re-send
+    st.markdown(_STYLE_TAG, unsafe_allow_html=True)
 
 def show_logo(width=200):
     try: